@@ -1,5 +1,9 @@
+import asyncio
+import threading
 import requests
-import json
+import httpx
+import serializer
+import token_counter
 from urllib.parse import urlparse
 import logging
 
@@ -17,32 +21,52 @@ class APIClient:
         self.session_states = {}
         self.last_request = None
         self.last_response = None
+        self.last_usage = None
+        self._async_client = None
+        self._async_loop = None  # 非同期クライアントを作成したイベントループ
+        self._async_lock = threading.Lock()
+        self._async_in_flight = {}  # 非同期クライアント -> 送信中のリクエスト数
 
-        # プロキシ設定の処理
-        if self.config.get('proxy_url'):
-            try:
-                proxy_url = self.config['proxy_url'].strip()
-                self.logger.info(f"Setting up proxy: {proxy_url}")
-
-                # プロキシURLのスキーム確認と追加
-                if not proxy_url.startswith(('http://', 'https://')):
-                    proxy_url = 'http://' + proxy_url
-
-                # プロキシURLの検証
-                parsed = urlparse(proxy_url)
-                if not all([parsed.scheme, parsed.netloc]):
-                    raise ValueError(f"Invalid proxy URL format: {proxy_url}")
-
-                # プロキシ設定を適用
-                self.session.proxies = {
-                    'http': proxy_url,
-                    'https': proxy_url
-                }
-                self.logger.info(f"Proxy configured successfully: {proxy_url}")
+        self._configure_proxy()
 
-            except Exception as e:
-                self.logger.error(f"Failed to configure proxy: {str(e)}")
-                self.session.proxies = {}
+    def _configure_proxy(self):
+        """プロキシ設定の処理"""
+        if not self.config.get('proxy_url'):
+            self.session.proxies = {}
+            return
+
+        try:
+            proxy_url = self.config['proxy_url'].strip()
+            self.logger.info(f"Setting up proxy: {proxy_url}")
+
+            # プロキシURLのスキーム確認と追加
+            if not proxy_url.startswith(('http://', 'https://')):
+                proxy_url = 'http://' + proxy_url
+
+            # プロキシURLの検証
+            parsed = urlparse(proxy_url)
+            if not all([parsed.scheme, parsed.netloc]):
+                raise ValueError(f"Invalid proxy URL format: {proxy_url}")
+
+            # プロキシ設定を適用
+            self.session.proxies = {
+                'http': proxy_url,
+                'https': proxy_url
+            }
+            self.logger.info(f"Proxy configured successfully: {proxy_url}")
+
+        except Exception as e:
+            self.logger.error(f"Failed to configure proxy: {str(e)}")
+            self.session.proxies = {}
+
+    def update_config(self, config):
+        """設定を差し替える（セッションと接続プールはそのまま再利用）"""
+        proxy_changed = config.get('proxy_url') != self.config.get('proxy_url')
+        self.config = config
+        if proxy_changed:
+            self._configure_proxy()
+            # 非同期クライアントは閉じて、次回送信時に新しいプロキシ設定で作り直す
+            self._close_async_client()
 
     def validate_api_endpoint(self, endpoint):
         """APIエンドポイントのURLを検証"""
@@ -57,20 +81,63 @@ class APIClient:
         except Exception as e:
             return False, f"Invalid API endpoint: {str(e)}"
 
+    def _get_chat_endpoint(self):
+        """チャットエンドポイントを取得・検証"""
+        api_endpoint = self.config.get('api_endpoint', '').strip()
+        is_valid, error_msg = self.validate_api_endpoint(api_endpoint)
+        if not is_valid:
+            raise ValueError(error_msg)
+
+        # チャットエンドポイントの確認
+        if not api_endpoint.endswith('/chat'):
+            api_endpoint = f"{api_endpoint.rstrip('/')}/chat"
+        return api_endpoint
+
+    def _check_token_budget(self, prompt_tokens):
+        """トークン予算を超える場合はエラーメッセージを返す"""
+        max_request_tokens = self.config.get('max_request_tokens', 0)
+        if max_request_tokens and prompt_tokens > max_request_tokens:
+            error_msg = (
+                f"Request exceeds token budget: ~{prompt_tokens} tokens "
+                f"(limit {max_request_tokens})"
+            )
+            self.logger.warning(error_msg)
+            return error_msg
+        return None
+
+    def _handle_response(self, content, body, prompt_tokens, thread_id):
+        """レスポンスをデコードし、使用量とセッション状態を記録"""
+        response_data = serializer.loads(content)
+        self.last_response = response_data
+        self.last_usage = {
+            "request_bytes": len(body),
+            "response_bytes": len(content),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": token_counter.estimate_tokens(
+                (response_data.get("message") or {}).get("content", "")
+            )
+        }
+
+        if thread_id:
+            self.session_states[thread_id] = response_data.get("session_state")
+
+        return response_data
+
     def send_message(self, chat_history, thread_id=None):
         try:
             # APIエンドポイントの取得と検証
-            api_endpoint = self.config.get('api_endpoint', '').strip()
-            is_valid, error_msg = self.validate_api_endpoint(api_endpoint)
-            if not is_valid:
-                raise ValueError(error_msg)
-
-            # チャットエンドポイントの確認
-            if not api_endpoint.endswith('/chat'):
-                api_endpoint = f"{api_endpoint.rstrip('/')}/chat"
+            api_endpoint = self._get_chat_endpoint()
 
             request_data = self._prepare_request_data(chat_history, thread_id)
             self.last_request = request_data
+            self.last_usage = None
+
+            # トークン予算の確認（超過する場合はネットワークに送信しない）
+            prompt_tokens = token_counter.estimate_request_tokens(request_data)
+            error_msg = self._check_token_budget(prompt_tokens)
+            if error_msg:
+                return {"error": error_msg}
+            body = serializer.dumps(request_data)
 
             self.logger.info("Preparing to send request")
             if self.session.proxies:
@@ -80,7 +147,7 @@ class APIClient:
             # プロキシ設定を使用してリクエストを送信
             response = self.session.post(
                 api_endpoint,
-                json=request_data,
+                data=body,
                 headers={
                     'Content-Type': 'application/json'
                 },
@@ -89,13 +156,7 @@ class APIClient:
             )
 
             response.raise_for_status()
-            response_data = response.json()
-            self.last_response = response_data
-
-            if thread_id:
-                self.session_states[thread_id] = response_data.get("session_state")
-
-            return response_data
+            return self._handle_response(response.content, body, prompt_tokens, thread_id)
 
         except requests.exceptions.ProxyError as e:
             error_msg = f"Proxy connection failed: {str(e)}"
@@ -105,15 +166,96 @@ class APIClient:
             error_msg = f"API request failed: {str(e)}"
             self.logger.error(error_msg)
             return {"error": error_msg}
-        except json.JSONDecodeError as e:
+        except serializer.JSONDecodeError as e:
+            error_msg = f"Invalid JSON response from API: {str(e)}"
+            self.logger.error(error_msg)
+            return {"error": error_msg}
+
+    def _acquire_async_client(self):
+        """非同期送信用のクライアントを取得し、送信中として数える（イベントループのスレッドから呼び出す）"""
+        with self._async_lock:
+            if self._async_client is None:
+                self._async_client = httpx.AsyncClient(
+                    proxy=self.session.proxies.get('http'),
+                    follow_redirects=True,  # リダイレクトを許可
+                    timeout=30.0
+                )
+                self._async_loop = asyncio.get_running_loop()
+            client = self._async_client
+            self._async_in_flight[client] = self._async_in_flight.get(client, 0) + 1
+            return client
+
+    def _release_async_client(self, client):
+        """送信の完了を記録し、差し替え済みのクライアントは最後の送信が終わった時点で閉じる"""
+        with self._async_lock:
+            remaining = self._async_in_flight.pop(client) - 1
+            if remaining:
+                self._async_in_flight[client] = remaining
+            retired = not remaining and client is not self._async_client
+        if retired:
+            asyncio.run_coroutine_threadsafe(client.aclose(), asyncio.get_running_loop())
+
+    def _close_async_client(self):
+        """非同期クライアントを破棄し、送信中のリクエストが無ければ作成したイベントループ上で接続を閉じる"""
+        with self._async_lock:
+            client, loop = self._async_client, self._async_loop
+            self._async_client = None
+            self._async_loop = None
+            # 送信中の場合は _release_async_client で最後の送信の完了後に閉じる
+            idle = client is not None and client not in self._async_in_flight
+        if idle and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    async def send_message_async(self, chat_history, thread_id=None):
+        """send_message の非同期版（タスクをキャンセルすると送信中のリクエストも中断される）"""
+        try:
+            api_endpoint = self._get_chat_endpoint()
+
+            request_data = self._prepare_request_data(chat_history, thread_id)
+            self.last_request = request_data
+            self.last_usage = None
+
+            prompt_tokens = token_counter.estimate_request_tokens(request_data)
+            error_msg = self._check_token_budget(prompt_tokens)
+            if error_msg:
+                return {"error": error_msg}
+            body = serializer.dumps(request_data)
+
+            self.logger.info(f"Sending async request to: {api_endpoint}")
+            client = self._acquire_async_client()
+            try:
+                response = await client.post(
+                    api_endpoint,
+                    content=body,
+                    headers={
+                        'Content-Type': 'application/json'
+                    }
+                )
+            finally:
+                self._release_async_client(client)
+
+            response.raise_for_status()
+            return self._handle_response(response.content, body, prompt_tokens, thread_id)
+
+        except httpx.ProxyError as e:
+            error_msg = f"Proxy connection failed: {str(e)}"
+            self.logger.error(error_msg)
+            return {"error": error_msg}
+        except httpx.HTTPError as e:
+            error_msg = f"API request failed: {str(e)}"
+            self.logger.error(error_msg)
+            return {"error": error_msg}
+        except serializer.JSONDecodeError as e:
             error_msg = f"Invalid JSON response from API: {str(e)}"
             self.logger.error(error_msg)
             return {"error": error_msg}
 
     def _prepare_request_data(self, chat_history, thread_id=None):
-        """リクエストデータの準備"""
+        """リクエストデータの準備（メッセージは役割と本文のみ送信し、コンテキストやブロブ参照は含めない）"""
         return {
-            "messages": chat_history,
+            "messages": [
+                {"role": message["role"], "content": message["content"]} for message in chat_history
+            ],
             "context": {
                 "thread_id": thread_id,
                 "overrides": {
@@ -4,6 +4,7 @@ class MessageDict(TypedDict):
     role: str
     content: str
     context: Optional[Dict[str, Any]]
+    context_refs: Optional[Dict[str, Any]]  # 保存済みコンテキストのブロブ参照（ChatManager._externalize_context を参照）
 
 class DataPoint(TypedDict):
     text: str
@@ -15,33 +16,117 @@ class Context(TypedDict):
 # 既存のインポート文は変更なし
 import streamlit as st
 from chat_manager import ChatManager
+from thread_cache import ThreadCache
+from async_sender import AsyncSender
 from config_manager import ConfigManager
 from api_client import APIClient
+from sanitizer import InputSanitizer
+from utils import sanitize_input
 import json
 from datetime import datetime
 
 # チャット履歴の型を定義
 ChatHistory = List[MessageDict]
 
+# バックグラウンドで先読みするスレッド数（更新日時の新しい順）
+PREFETCH_THREADS = 5
+# 全セッションで同時に送信するリクエスト数の上限
+MAX_CONCURRENT_SENDS = 4
+
+@st.cache_resource
+def get_thread_cache():
+    """全セッションで共有するスレッド履歴キャッシュ"""
+    return ThreadCache(ChatManager())
+
+@st.cache_resource
+def get_async_sender():
+    """全セッションで共有するバックグラウンド送信処理"""
+    return AsyncSender(max_concurrent=MAX_CONCURRENT_SENDS)
+
 def initialize_session_state():
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history: ChatHistory = []
-    if 'config' not in st.session_state:
-        st.session_state.config = ConfigManager.get_default_config()
+    # 設定はキャッシュ済みのものを取得（ファイルが更新されていれば再読み込みされる）
+    st.session_state.config = ConfigManager.load_config()
     if 'current_thread_id' not in st.session_state:
         st.session_state.current_thread_id = None
     if 'chat_manager' not in st.session_state:
-        st.session_state.chat_manager = ChatManager()
+        st.session_state.chat_manager = ChatManager(history_cache=get_thread_cache())
     if 'api_client' not in st.session_state:
         st.session_state.api_client = APIClient(st.session_state.config)
+        # 設定変更時は接続プールを維持したまま APIClient に反映
+        ConfigManager.subscribe(st.session_state.api_client.update_config)
     if 'debug_mode' not in st.session_state:
         st.session_state.debug_mode = False
+    if 'pending_send' not in st.session_state:
+        st.session_state.pending_send = None
 
 def format_datetime(iso_string):
     """ISO形式の日時文字列を読みやすい形式に変換"""
     dt = datetime.fromisoformat(iso_string)
     return dt.strftime("%Y/%m/%d %H:%M")
 
+def sanitize_prompt(prompt):
+    """設定のサイズ上限・許可タグに従って入力をサニタイズ（拒否された場合は None）"""
+    sanitizer = InputSanitizer(
+        max_input_size=st.session_state.config.get('max_input_size', 5_000_000),
+        oversize_policy=st.session_state.config.get('oversize_policy', 'truncate'),
+        allowed_tags=st.session_state.config.get('allowed_tags', [])
+    )
+    try:
+        return sanitize_input(prompt, sanitizer) or None
+    except ValueError as e:
+        st.error(f"Input rejected: {str(e)}")
+        return None
+
+def format_usage(usage):
+    """スレッドの通信量・トークン数の累計を表示用に整形"""
+    if not usage:
+        return "No requests yet"
+    tokens = usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0)
+    kilobytes = (usage.get('request_bytes', 0) + usage.get('response_bytes', 0)) / 1024
+    return f"{usage.get('requests', 0)} req · ~{tokens:,} tokens · {kilobytes:,.1f} KB"
+
+@st.fragment(run_every=1)
+def render_pending_send():
+    """送信中メッセージのプレースホルダ（経過時間・待ち順・キャンセル）を1秒ごとに更新"""
+    pending = st.session_state.pending_send
+    if pending is None:
+        return
+    sender = get_async_sender()
+
+    if pending.finished:
+        st.session_state.pending_send = None
+        if pending.status == 'done':
+            if st.session_state.current_thread_id == pending.thread_id:
+                st.session_state.chat_history = pending.history
+        elif pending.status == 'error':
+            st.session_state.send_notice = ('error', f"Error: {pending.error}")
+        else:
+            st.session_state.send_notice = ('info', "Request cancelled.")
+        st.rerun()
+
+    if st.session_state.current_thread_id != pending.thread_id:
+        st.caption(f"⏳ Sending a message in another thread... {pending.elapsed:.0f}s")
+        return
+
+    with st.chat_message("assistant"):
+        position = sender.queue_position(pending)
+        if position:
+            st.write(f"⏳ Waiting in queue (position {position}) · {pending.elapsed:.0f}s")
+        else:
+            st.write(f"⏳ Waiting for response... {pending.elapsed:.0f}s")
+        if st.button("Cancel", key=f"cancel_{pending.id}"):
+            if sender.cancel(pending):
+                # キャンセルした場合は送信前の履歴に戻す
+                if st.session_state.current_thread_id == pending.thread_id:
+                    st.session_state.chat_history = pending.history[:-1]
+                st.session_state.pending_send = None
+                st.session_state.send_notice = ('info', "Request cancelled.")
+                st.rerun()
+            # 応答を受信済みの場合は保存の完了を待ち、次回の更新で反映する
+            st.caption("The response has already arrived and is being saved.")
+
 def main():
     st.set_page_config(
         page_title="Proxy Chat App",
@@ -51,6 +136,7 @@ def main():
 
     initialize_session_state()
     chat_manager = st.session_state.chat_manager
+    thread_cache = get_thread_cache()
 
     # サイドバーの設定
     with st.sidebar:
@@ -71,15 +157,15 @@ def main():
             thread_info = chat_manager.create_thread(new_thread_title)
             st.session_state.current_thread_id = thread_info['id']
             st.session_state.chat_history = []
-            # 新しいスレッドを作成したら、APIClientも新しく初期化
-            st.session_state.api_client = APIClient(st.session_state.config)
             st.success(f"Created new thread: {thread_info['title']}")
             st.rerun()
 
         # スレッド一覧
         st.subheader("Threads")
-        threads = chat_manager.list_threads()
-        for thread in sorted(threads, key=lambda x: x['updated_at'], reverse=True):
+        threads = sorted(thread_cache.list_threads(), key=lambda x: x['updated_at'], reverse=True)
+        # 切り替えられる可能性の高いスレッドを先読み
+        thread_cache.prefetch([t['id'] for t in threads[:PREFETCH_THREADS]])
+        for thread in threads:
             col1, col2 = st.columns([3, 1])
             with col1:
                 if st.button(
@@ -88,12 +174,13 @@ def main():
                     help=f"Created: {format_datetime(thread['created_at'])}\nUpdated: {format_datetime(thread['updated_at'])}"
                 ):
                     st.session_state.current_thread_id = thread['id']
-                    st.session_state.chat_history = chat_manager.get_thread_history(thread['id'])
+                    st.session_state.chat_history = thread_cache.get_thread_history(thread['id'])
                     # スレッドを切り替えたとき、保存されているセッション状態を復元
-                    session_state = chat_manager.get_thread_session_state(thread['id'])
+                    session_state = thread_cache.get_thread_session_state(thread['id'])
                     if session_state:
                         st.session_state.api_client.update_session_state(thread['id'], session_state)
                     st.rerun()
+                st.caption(format_usage(thread.get('usage')))
             with col2:
                 if st.button("🗑️", key=f"delete_{thread['id']}", help="Delete this thread"):
                     chat_manager.delete_thread(thread['id'])
@@ -128,20 +215,22 @@ def main():
         )
 
         st.subheader("Search Parameters")
+        retrieval_modes = ["hybrid", "text", "vectors"]
         retrieval_mode = st.selectbox(
             "Retrieval Mode",
-            options=["hybrid", "text", "vectors"],
-            index=0
+            options=retrieval_modes,
+            index=retrieval_modes.index(st.session_state.config.get('retrieval_mode', 'hybrid'))
+            if st.session_state.config.get('retrieval_mode') in retrieval_modes else 0
         )
 
-        top_k = st.slider("Top K Documents", 1, 20, 5)
-        temperature = st.slider("Temperature", 0.0, 1.0, 0.7)
+        top_k = st.slider("Top K Documents", 1, 20, st.session_state.config.get('top_k', 5))
+        temperature = st.slider("Temperature", 0.0, 1.0, float(st.session_state.config.get('temperature', 0.7)))
 
         st.subheader("Advanced Settings")
         with st.expander("Advanced Settings", expanded=False):
-            semantic_ranker = st.checkbox("Use Semantic Ranker", value=True)
-            semantic_captions = st.checkbox("Use Semantic Captions", value=True)
-            followup_questions = st.checkbox("Suggest Followup Questions", value=True)
+            semantic_ranker = st.checkbox("Use Semantic Ranker", value=st.session_state.config.get('semantic_ranker', True))
+            semantic_captions = st.checkbox("Use Semantic Captions", value=st.session_state.config.get('semantic_captions', True))
+            followup_questions = st.checkbox("Suggest Followup Questions", value=st.session_state.config.get('followup_questions', True))
 
             st.subheader("Prompt Template")
             prompt_template = st.text_area(
@@ -153,6 +242,7 @@ def main():
 
         if st.button("Save Settings"):
             new_config = {
+                **st.session_state.config,
                 'proxy_url': proxy_url,
                 'api_endpoint': api_endpoint,
                 'retrieval_mode': retrieval_mode,
@@ -163,10 +253,13 @@ def main():
                 'followup_questions': followup_questions,
                 'prompt_template': prompt_template
             }
-            ConfigManager.save_config(new_config)
-            st.session_state.config = new_config
-            st.session_state.api_client = APIClient(new_config)  # APIクライアントを新しい設定で再初期化
-            st.success("Settings saved successfully!")
+            try:
+                # 保存時に購読中の APIClient へ新しい設定が通知される
+                ConfigManager.save_config(new_config)
+                st.session_state.config = new_config
+                st.success("Settings saved successfully!")
+            except ValueError as e:
+                st.error(f"Invalid settings: {str(e)}")
 
     # メインチャットインターフェース
     st.title("💬 Proxy Chat")
@@ -174,7 +267,7 @@ def main():
     # 現在のスレッド情報を表示
     if st.session_state.current_thread_id:
         thread_info = next(
-            (t for t in chat_manager.list_threads() if t['id'] == st.session_state.current_thread_id),
+            (t for t in thread_cache.list_threads() if t['id'] == st.session_state.current_thread_id),
             None
         )
         if thread_info:
@@ -191,85 +284,64 @@ def main():
         st.caption("No thread selected. Please create or select a thread from the sidebar.")
 
     # チャット履歴の表示
-    for message in st.session_state.chat_history:
+    for index, message in enumerate(st.session_state.chat_history):
         with st.chat_message(message["role"]):
             st.write(message["content"])
             if message["role"] == "assistant":
-                if "context" in message:
+                if "context" in message or "context_refs" in message:
+                    # 保存済みのコンテキストは開いたときだけブロブストアから読み込む
+                    # （st.expander は閉じていても中身が実行されるためトグルで開閉する）
+                    key = f"{st.session_state.current_thread_id}_{index}"
                     col1, col2 = st.columns(2)
                     with col1:
-                        with st.expander("データポイント"):
-                            if "data_points" in message["context"]:
-                                for point in message["context"]["data_points"]:
-                                    st.write(point["text"])
+                        if st.toggle("データポイント", key=f"data_points_{key}"):
+                            data_points = chat_manager.resolve_context_field(st.session_state.chat_history, index, "data_points")
+                            for point in data_points or []:
+                                st.write(point["text"])
                     with col2:
-                        with st.expander("過去のやりとり"):
-                            if "chat_history" in message["context"]:
-                                st.text(message["context"]["chat_history"])
+                        if st.toggle("過去のやりとり", key=f"chat_history_{key}"):
+                            chat_history = chat_manager.resolve_context_field(st.session_state.chat_history, index, "chat_history")
+                            if chat_history:
+                                st.text(chat_history)
+
+    # デバッグモードの場合、直近のAPIリクエスト/レスポンス情報を表示
+    if st.session_state.debug_mode and st.session_state.api_client.last_response:
+        with st.expander("🔍 API Debug Info", expanded=False):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.subheader("Request")
+                st.json(st.session_state.api_client.last_request)
+            with col2:
+                st.subheader("Response")
+                st.json(st.session_state.api_client.last_response)
+
+    # 前回の送信結果（エラー・キャンセル）の通知
+    if notice := st.session_state.pop('send_notice', None):
+        level, text = notice
+        if level == 'error':
+            st.error(text)
+        else:
+            st.info(text)
+
+    # 送信中のメッセージ（他のスレッドを表示中でも完了を検知する）
+    pending = st.session_state.pending_send
+    if pending:
+        render_pending_send()
 
     # チャット入力（スレッドが選択されている場合のみ有効）
     if st.session_state.current_thread_id:
-        if prompt := st.chat_input("Type your message here..."):
+        # 送信前に入力をサニタイズ（空になった・拒否された入力は送信しない）
+        if (prompt := st.chat_input("Type your message here...", disabled=pending is not None)) \
+                and (prompt := sanitize_prompt(prompt)):
+            # 応答を待たずにユーザーメッセージを表示し、送信はバックグラウンドで行う
             st.session_state.chat_history.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.write(prompt)
-
-            try:
-                response = st.session_state.api_client.send_message(
-                    st.session_state.chat_history,
-                    thread_id=st.session_state.current_thread_id
-                )
-
-                if response.get("error"):
-                    st.error(f"Error: {response['error']}")
-                else:
-                    message = response["message"]
-                    st.session_state.chat_history.append({
-                        "role": message["role"],
-                        "content": message["content"],
-                        "context": response.get("context", {})
-                    })
-
-                    # スレッドの履歴を保存
-                    chat_manager.save_thread_history(
-                        st.session_state.current_thread_id,
-                        st.session_state.chat_history
-                    )
-
-                    # セッション状態を保存
-                    if response.get("session_state"):
-                        chat_manager.update_thread_session_state(
-                            st.session_state.current_thread_id,
-                            response["session_state"]
-                        )
-
-                    with st.chat_message("assistant"):
-                        st.write(message["content"])
-                        if response.get("context"):
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                with st.expander("データポイント"):
-                                    if "data_points" in response["context"]:
-                                        for point in response["context"]["data_points"]:
-                                            st.write(point["text"])
-                            with col2:
-                                with st.expander("過去のやりとり"):
-                                    if "chat_history" in response["context"]:
-                                        st.text(response["context"]["chat_history"])
-
-                        # デバッグモードの場合、APIリクエスト/レスポンス情報を表示
-                        if st.session_state.debug_mode:
-                            with st.expander("🔍 API Debug Info", expanded=True):
-                                col1, col2 = st.columns(2)
-                                with col1:
-                                    st.subheader("Request")
-                                    st.json(st.session_state.api_client.last_request)
-                                with col2:
-                                    st.subheader("Response")
-                                    st.json(st.session_state.api_client.last_response)
-
-            except Exception as e:
-                st.error(f"An error occurred: {str(e)}")
+            st.session_state.pending_send = get_async_sender().submit(
+                st.session_state.api_client,
+                chat_manager,
+                st.session_state.current_thread_id,
+                st.session_state.chat_history
+            )
+            st.rerun()
     else:
         st.info("Please select or create a thread to start chatting.")
 
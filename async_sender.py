@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class PendingSend:
+    """バックグラウンドで送信中のメッセージ"""
+
+    def __init__(self, thread_id, history):
+        self.id = str(uuid.uuid4())
+        self.thread_id = thread_id
+        self.history = history  # 送信するユーザーメッセージを含む履歴
+        self.status = 'queued'  # queued / running / saving / done / error / cancelled
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.future = None
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'error', 'cancelled')
+
+    @property
+    def elapsed(self):
+        """送信要求からの経過秒数"""
+        return time.monotonic() - self.submitted_at
+
+
+class AsyncSender:
+    """専用スレッドのイベントループでメッセージ送信と保存を行う
+
+    同時に送信するリクエスト数は max_concurrent に制限し、超過分は到着順に待機させる。
+    """
+
+    def __init__(self, max_concurrent=4):
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._waiting = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._loop.run_forever, name="async-sender", daemon=True).start()
+
+    def submit(self, api_client, chat_manager, thread_id, history):
+        """送信を登録し、PendingSend を返す"""
+        pending = PendingSend(thread_id, list(history))
+        with self._lock:
+            self._waiting.append(pending)
+        pending.future = asyncio.run_coroutine_threadsafe(
+            self._run(pending, api_client, chat_manager), self._loop
+        )
+        return pending
+
+    def queue_position(self, pending):
+        """待機中の順番（1始まり、送信中・完了済みは0）"""
+        with self._lock:
+            try:
+                return self._waiting.index(pending) + 1
+            except ValueError:
+                return 0
+
+    def cancel(self, pending):
+        """送信をキャンセルし、キャンセルできたかを返す（送信中の HTTP リクエストも中断される）"""
+        with self._lock:
+            if pending.finished or pending.status == 'saving':
+                # 完了済み、または応答を受信済みで保存中のものはキャンセルしない
+                return False
+            self._mark_cancelled_locked(pending)
+        pending.future.cancel()
+        return True
+
+    def _mark_cancelled(self, pending):
+        with self._lock:
+            self._mark_cancelled_locked(pending)
+
+    def _mark_cancelled_locked(self, pending):
+        if pending in self._waiting:
+            self._waiting.remove(pending)
+        pending.status = 'cancelled'
+
+    def _set_status(self, pending, status):
+        """キャンセルされていなければ状態を更新し、更新できたかを返す"""
+        with self._lock:
+            if pending.status == 'cancelled':
+                return False
+            pending.status = status
+            return True
+
+    async def _run(self, pending, api_client, chat_manager):
+        try:
+            async with self._semaphore:
+                with self._lock:
+                    if pending in self._waiting:
+                        self._waiting.remove(pending)
+                if not self._set_status(pending, 'running'):
+                    return
+                pending.started_at = time.monotonic()
+
+                response = await api_client.send_message_async(pending.history, thread_id=pending.thread_id)
+                if response.get("error"):
+                    pending.error = response["error"]
+                    self._set_status(pending, 'error')
+                    return
+
+                message = response["message"]
+                history = pending.history + [{
+                    "role": message["role"],
+                    "content": message["content"],
+                    "context": response.get("context", {})
+                }]
+                # 保存開始後はキャンセルできない（cancel との競合はロックで判定）
+                if not self._set_status(pending, 'saving'):
+                    return
+                # 保存は描画処理とは別スレッドで行う
+                stored = await asyncio.to_thread(
+                    self._persist, chat_manager, pending.thread_id, history,
+                    api_client.last_usage, response.get("session_state")
+                )
+                # 保存した形式（コンテキストは参照）をセッションに戻し、表示時に必要な分だけ読み込む
+                pending.history = stored if stored is not None else history
+                self._set_status(pending, 'done')
+        except asyncio.CancelledError:
+            self._mark_cancelled(pending)
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send message: {str(e)}")
+            pending.error = str(e)
+            self._set_status(pending, 'error')
+
+    @staticmethod
+    def _persist(chat_manager, thread_id, history, usage, session_state):
+        """スレッドの履歴・使用量・セッション状態を保存し、保存した形式の履歴を返す
+
+        送信中にスレッドが削除された場合は保存せず None を返す。
+        """
+        stored = chat_manager.save_thread_history(thread_id, history)
+        if stored is None:
+            logger.info(f"Thread {thread_id} was deleted; discarding the response")
+            return None
+        chat_manager.record_thread_usage(thread_id, usage)
+        if session_state:
+            chat_manager.update_thread_session_state(thread_id, session_state)
+        return stored
@@ -0,0 +1,112 @@
+"""プロキシサーバのワーカー数ごとのスループットを計測するベンチマーク
+
+使い方:
+    python benchmarks/proxy_workers.py --workers 1 2 4 --requests 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAYLOAD = {
+    "messages": [{"role": "user", "content": "ベンチマーク用の質問です"}],
+    "context": {"overrides": {}},
+    "session_state": None
+}
+
+
+def wait_for_port(url, timeout=30.0):
+    """サーバが応答するまで待機"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server did not start: {url}")
+
+
+async def run_load(url, total, concurrency):
+    """指定した並列数でリクエストを送信し、スループットを返す"""
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    errors = 0
+
+    async def worker(client):
+        nonlocal errors
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                response = await client.post(url, json=PAYLOAD, timeout=30.0)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return total / elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=3000)
+    args = parser.parse_args()
+
+    # プロキシの転送先となるモックサーバ（ポート8000）を起動
+    # モック側がボトルネックにならないよう十分なワーカー数で起動する
+    mock = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "mock_server:app", "--port", "8000",
+         "--workers", str(max(args.workers) * 2), "--log-level", "warning"],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port("http://localhost:8000/")
+        base = None
+        for workers in args.workers:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, PROXY_STATE_DB=os.path.join(tmp, "state.db"))
+                proxy = subprocess.Popen(
+                    [sys.executable, "proxy_server.py",
+                     "--port", str(args.port), "--workers", str(workers)],
+                    cwd=ROOT, env=env,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+                try:
+                    wait_for_port(f"http://localhost:{args.port}/")
+                    url = f"http://localhost:{args.port}/chat"
+                    asyncio.run(run_load(url, min(100, args.requests), args.concurrency))  # ウォームアップ
+                    rps, errors = asyncio.run(run_load(url, args.requests, args.concurrency))
+                    history = httpx.get(f"http://localhost:{args.port}/history").json()
+                finally:
+                    proxy.terminate()
+                    proxy.wait()
+            base = base or rps
+            print(
+                f"workers={workers:<3} {rps:9.1f} req/s  "
+                f"scaling={rps / base:5.2f}x  errors={errors}  history={len(history)}"
+            )
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
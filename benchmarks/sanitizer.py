@@ -0,0 +1,109 @@
+"""入力サニタイザの計算量ベンチマークとファジング
+
+1. ファジング: ランダムな入力に対して旧正規表現実装と結果が一致することを確認
+2. ベンチマーク: 敵対的な入力を倍々に大きくし、処理時間が線形に伸びることを確認
+
+使い方:
+    python benchmarks/sanitizer.py --fuzz-cases 20000 --max-size 8000000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sanitizer import InputSanitizer  # noqa: E402
+
+# 旧実装（<script> の大文字小文字のみ新実装に合わせる）
+LEGACY_SCRIPT = re.compile(r'<script.*?>.*?</script>', re.DOTALL | re.IGNORECASE)
+LEGACY_TAG = re.compile(r'<.*?>')
+
+MIN_JUDGED_SECONDS = 0.005
+
+FUZZ_ALPHABET = ['<', '>', '/', 'a', ' ', '\n', 'script', 'SCRIPT', '<script>', '</script>', '</ScRiPt>', '<b>', 'x']
+
+ADVERSARIAL_INPUTS = {
+    "unclosed '<'": lambda n: '<' * n,
+    "unclosed <script": lambda n: '<script' * (n // 7),
+    "<script> without close": lambda n: '<script>' * (n // 8),
+    "'<a' then '>' at end": lambda n: '<a' * (n // 2) + '>',
+    "log lines with tags": lambda n: ('2024-01-01 INFO <worker-1> processed <id=42>\n' * (n // 47)),
+}
+
+
+def legacy_sanitize(text):
+    """旧 utils.sanitize_input 相当"""
+    if not text:
+        return text
+    text = LEGACY_SCRIPT.sub('', text)
+    text = LEGACY_TAG.sub('', text)
+    return text.strip()
+
+
+def fuzz(cases, seed):
+    """ランダム入力で旧実装と一致するか検証"""
+    rng = random.Random(seed)
+    sanitizer = InputSanitizer(max_input_size=0)
+    for i in range(cases):
+        text = ''.join(rng.choice(FUZZ_ALPHABET) for _ in range(rng.randint(0, 40)))
+        expected = legacy_sanitize(text)
+        actual = sanitizer.sanitize(text)
+        if expected != actual:
+            raise AssertionError(f"case {i}: {text!r} -> {actual!r}, expected {expected!r}")
+    print(f"fuzz: {cases} cases matched the reference implementation")
+
+
+def timed(func, text, repeat=3):
+    """処理時間（秒、最良値）を計測"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def benchmark(max_size, legacy_limit):
+    """敵対的入力でサイズを倍にしたときの処理時間の伸びを確認"""
+    sanitizer = InputSanitizer(max_input_size=0)
+    worst_growth = 0.0
+    for name, make in ADVERSARIAL_INPUTS.items():
+        print(f"\n[{name}]")
+        previous = None
+        size = max_size // 16
+        while size <= max_size:
+            text = make(size)
+            elapsed = timed(sanitizer.sanitize, text)
+            growth = elapsed / previous if previous else float('nan')
+            # 数ミリ秒未満の計測は誤差が大きいため判定に含めない
+            if previous and previous >= MIN_JUDGED_SECONDS:
+                worst_growth = max(worst_growth, growth)
+            line = f"  {len(text):>9} chars  {elapsed * 1000:9.2f} ms  x{growth:4.2f}"
+            if len(text) <= legacy_limit:
+                line += f"  (legacy {timed(legacy_sanitize, text, repeat=1) * 1000:9.2f} ms)"
+            print(line)
+            previous = elapsed
+            size *= 2
+    # 線形なら入力を倍にしても時間はおよそ2倍（計測誤差を考慮して3倍未満を判定基準にする）
+    print(f"\nworst growth per doubling: x{worst_growth:.2f} ({'linear' if worst_growth < 3 else 'SUPERLINEAR'})")
+    return worst_growth < 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fuzz-cases", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-size", type=int, default=8_000_000)
+    parser.add_argument("--legacy-limit", type=int, default=16_000, help="旧実装を計測する最大サイズ")
+    args = parser.parse_args()
+
+    fuzz(args.fuzz_cases, args.seed)
+    if not benchmark(args.max_size, args.legacy_limit):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
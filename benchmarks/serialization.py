@@ -0,0 +1,84 @@
+"""1ターンあたりのJSONシリアライズに要するCPU時間を比較するベンチマーク
+
+標準ライブラリのみの旧経路と serializer モジュール経由の経路で、
+1ターン分のエンコード/デコード（クライアント送信・モック受信/応答・
+プロキシ転送・クライアント受信・履歴保存）を再現して計測する。
+
+使い方:
+    python benchmarks/serialization.py --turns 20 --repeat 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serializer  # noqa: E402
+
+
+def build_history(turns):
+    """指定ターン数のチャット履歴を生成"""
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"質問 {i}: " + "詳細な説明をお願いします。" * 10})
+        history.append({
+            "role": "assistant",
+            "content": f"応答 #{i}: " + "これは回答の本文です。" * 30,
+            "context": {
+                "data_points": [{"text": "参照ドキュメントの抜粋です。" * 20} for _ in range(5)],
+                "chat_history": "\n".join(f"{j}. user: 質問 {j}" for j in range(i + 1))
+            }
+        })
+    return history
+
+
+def stdlib_turn(history, response):
+    """旧実装相当のシリアライズ経路"""
+    body = json.dumps({"messages": history}).encode('utf-8')          # APIClient (json=)
+    json.loads(body)                                                  # mock: request.json()
+    upstream = json.dumps(response).encode('utf-8')                   # mock: 既定エンコーダ
+    proxied = json.dumps(json.loads(upstream)).encode('utf-8')        # proxy: response.json() + JSONResponse
+    json.loads(proxied)                                               # APIClient: response.json()
+    json.dumps(history, ensure_ascii=False, indent=2)                 # ChatManager: indent=2 で保存
+
+
+def fast_turn(history, response):
+    """serializer モジュール経由の経路"""
+    body = serializer.dumps({"messages": history})                    # APIClient
+    serializer.loads(body)                                            # mock
+    upstream = serializer.dumps(response)                             # mock: ORJSONResponse
+    proxied = upstream                                                # proxy: バイト列をそのまま転送
+    serializer.loads(proxied)                                         # APIClient
+    serializer.dumps(history)                                         # ChatManager: コンパクト保存
+
+
+def measure(func, history, response, repeat):
+    """CPU時間（秒/ターン）を計測"""
+    started = time.process_time()
+    for _ in range(repeat):
+        func(history, response)
+    return (time.process_time() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=20, help="履歴に含めるターン数")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    history = build_history(args.turns)
+    response = {"message": history[-1], "context": history[-1]["context"], "session_state": {"session_id": "x"}}
+
+    baseline = measure(stdlib_turn, history, response, args.repeat)
+    fast = measure(fast_turn, history, response, args.repeat)
+    backend = "orjson" if serializer.HAS_ORJSON else "stdlib fallback"
+    print(f"history turns : {args.turns}")
+    print(f"stdlib        : {baseline * 1000:8.3f} ms CPU/turn")
+    print(f"serializer    : {fast * 1000:8.3f} ms CPU/turn ({backend})")
+    print(f"saved         : {(baseline - fast) * 1000:8.3f} ms CPU/turn ({baseline / fast:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
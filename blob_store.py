@@ -0,0 +1,117 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import zlib
+from functools import lru_cache
+
+import serializer
+from utils import atomic_write
+
+
+class BlobStore:
+    """内容アドレス方式（SHA-256 → 圧縮済みJSON）のブロブストア
+
+    参照はスレッド単位で索引（SQLite）に記録し、どのスレッドからも参照されなくなった
+    ブロブは削除する。ブロブファイルの書き込み・削除は索引の書き込みロック内で行うため、
+    複数のプロセス・スレッドから同時に保存しても参照中のブロブが消えることはない。
+    """
+
+    def __init__(self, root="chat_blobs", cache_size=256):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        self._local = threading.local()
+        self._ensure_schema()
+        self._cached_get = lru_cache(maxsize=cache_size)(self._read_blob)
+
+    def _get_connection(self):
+        """スレッドごとの接続を取得"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.root, "index.db"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        """テーブルを作成"""
+        self._get_connection().execute(
+            "CREATE TABLE IF NOT EXISTS refs ("
+            "thread_id TEXT NOT NULL, "
+            "hash TEXT NOT NULL, "
+            "PRIMARY KEY (thread_id, hash))"
+        )
+        self._get_connection().execute("CREATE INDEX IF NOT EXISTS refs_hash ON refs (hash)")
+
+    def _blob_path(self, blob_hash):
+        return os.path.join(self.root, blob_hash[:2], blob_hash)
+
+    @staticmethod
+    def encode(value):
+        """値を正規化した JSON に変換し、(ハッシュ, bytes) を返す"""
+        data = serializer.dumps(value, sort_keys=True)
+        return hashlib.sha256(data).hexdigest(), data
+
+    def _write_blob(self, blob_hash, data):
+        """ブロブが未保存であれば圧縮して書き込む"""
+        path = self._blob_path(blob_hash)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, zlib.compress(data))
+
+    def _read_blob(self, blob_hash):
+        with open(self._blob_path(blob_hash), 'rb') as f:
+            return serializer.loads(zlib.decompress(f.read()))
+
+    def get(self, blob_hash):
+        """ブロブを取得（存在しない場合は None）"""
+        try:
+            return self._cached_get(blob_hash)
+        except FileNotFoundError:
+            return None
+
+    def set_thread_refs(self, thread_id, blobs):
+        """スレッドが参照するブロブ（ハッシュ → bytes または None）を保存し、参照されなくなったブロブを削除"""
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for blob_hash, data in blobs.items():
+                # data が None のものは保存済みブロブへの参照のみ
+                if data is not None:
+                    self._write_blob(blob_hash, data)
+            released = {
+                row[0] for row in conn.execute("SELECT hash FROM refs WHERE thread_id = ?", (thread_id,))
+            } - set(blobs)
+            conn.execute("DELETE FROM refs WHERE thread_id = ?", (thread_id,))
+            conn.executemany(
+                "INSERT INTO refs (thread_id, hash) VALUES (?, ?)",
+                [(thread_id, blob_hash) for blob_hash in blobs]
+            )
+            self._collect_garbage(conn, released)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release_thread(self, thread_id):
+        """スレッドの参照をすべて解放し、最後の参照だったブロブを削除"""
+        self.set_thread_refs(thread_id, {})
+
+    def refcount(self, blob_hash):
+        """ブロブを参照しているスレッド数"""
+        row = self._get_connection().execute(
+            "SELECT COUNT(*) FROM refs WHERE hash = ?", (blob_hash,)
+        ).fetchone()
+        return row[0]
+
+    def _collect_garbage(self, conn, candidates):
+        """参照が残っていないブロブを削除（書き込みロック内で呼び出す）"""
+        for blob_hash in candidates:
+            if conn.execute("SELECT 1 FROM refs WHERE hash = ? LIMIT 1", (blob_hash,)).fetchone():
+                continue
+            try:
+                os.remove(self._blob_path(blob_hash))
+            except FileNotFoundError:
+                pass
+            self._cached_get.cache_clear()
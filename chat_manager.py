@@ -1,13 +1,28 @@
-import json
+import serializer
+from blob_store import BlobStore
+from utils import atomic_write, file_lock
+from contextlib import contextmanager
 from datetime import datetime
 import base64
+import hashlib
 import os
+import threading
 import uuid
 
+def _text_digest(text):
+    return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()
+
 class ChatManager:
-    def __init__(self):
+    # スレッド一覧の読み込み〜書き込みを排他するロック（プロセス内の全インスタンスで共有）
+    _index_lock = threading.Lock()
+
+    def __init__(self, history_cache=None, blob_store=None):
         self.threads_file = "chat_threads.json"
         self.threads_dir = "chat_threads"
+        # 書き込み時に無効化する共有キャッシュ（ThreadCache）
+        self.history_cache = history_cache
+        # メッセージのコンテキストを重複なく保存するストア
+        self.blob_store = blob_store or BlobStore()
         self._ensure_threads_directory()
 
     def _ensure_threads_directory(self):
@@ -19,6 +34,21 @@ class ChatManager:
         """スレッドファイルのパスを取得"""
         return os.path.join(self.threads_dir, f"{thread_id}.json")
 
+    def _write_json(self, path, data):
+        """JSON をアトミックに書き込み"""
+        atomic_write(path, serializer.dumps(data))
+
+    @contextmanager
+    def _lock_threads(self):
+        """スレッド一覧の更新を排他（プロセス内はロック、プロセス間はロックファイル）"""
+        with self._index_lock, file_lock(f"{self.threads_file}.lock"):
+            yield
+
+    def _invalidate_cache(self, thread_id=None):
+        """共有キャッシュのエントリを無効化"""
+        if self.history_cache is not None:
+            self.history_cache.invalidate(thread_id)
+
     def create_thread(self, title=None):
         """新しいチャットスレッドを作成"""
         thread_id = str(uuid.uuid4())
@@ -40,51 +70,191 @@ class ChatManager:
 
     def save_thread_info(self, thread_info):
         """スレッド情報を保存"""
-        threads = self.list_threads()
-        threads = [t for t in threads if t['id'] != thread_info['id']]
-        threads.append(thread_info)
+        with self._lock_threads():
+            threads = self.list_threads()
+            threads = [t for t in threads if t['id'] != thread_info['id']]
+            threads.append(thread_info)
+            self._write_json(self.threads_file, threads)
+        self._invalidate_cache()
 
-        with open(self.threads_file, 'w', encoding='utf-8') as f:
-            json.dump(threads, f, ensure_ascii=False, indent=2)
+    def _update_thread(self, thread_id, update):
+        """一覧中のスレッド情報を update で更新して保存し、スレッドが存在したかを返す"""
+        with self._lock_threads():
+            threads = self.list_threads()
+            for thread in threads:
+                if thread['id'] == thread_id:
+                    update(thread)
+                    self._write_json(self.threads_file, threads)
+                    break
+            else:
+                return False
+        self._invalidate_cache()
+        return True
 
     def list_threads(self):
         """全スレッド一覧を取得"""
         try:
-            with open(self.threads_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self.threads_file, 'rb') as f:
+                return serializer.loads(f.read())
         except FileNotFoundError:
             return []
 
     def get_thread_history(self, thread_id):
         """特定のスレッドの履歴を取得"""
         try:
-            with open(self._get_thread_file_path(thread_id), 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self._get_thread_file_path(thread_id), 'rb') as f:
+                return serializer.loads(f.read())
         except FileNotFoundError:
             return []
 
-    def save_thread_history(self, thread_id, history):
-        """スレッドの履歴を保存"""
-        file_path = self._get_thread_file_path(thread_id)
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+    def _externalize_context(self, message, blobs, stored_history):
+        """メッセージのコンテキストをブロブへ移し、参照に置き換える
 
-        # 最終更新日時を更新
-        threads = self.list_threads()
-        for thread in threads:
-            if thread['id'] == thread_id:
-                thread['updated_at'] = datetime.now().isoformat()
-                self.save_thread_info(thread)
+        参照の形式は項目の値によって異なる。
+        - リスト（data_points など）: 要素ごとのハッシュのリスト（同じ文書は質問・スレッドをまたいで共有）
+        - 文字列（chat_history など）: {'length', 'sha256', 'append', 'base'}
+          直前のメッセージの同じ項目に追記した内容であれば、追記分のみを append に保存し base に元のメッセージの位置を記録
+        - その他: 値全体のハッシュ
+        """
+        if 'context' not in message:
+            return message
+        context_refs = {}
+        for key, value in (message['context'] or {}).items():
+            if isinstance(value, list):
+                context_refs[key] = [self._store_blob(item, blobs) for item in value]
+            elif isinstance(value, str):
+                context_refs[key] = self._externalize_text(key, value, blobs, stored_history)
+            else:
+                context_refs[key] = self._store_blob(value, blobs)
+        stored = {k: v for k, v in message.items() if k != 'context'}
+        stored['context_refs'] = context_refs
+        return stored
+
+    def _store_blob(self, value, blobs):
+        blob_hash, data = self.blob_store.encode(value)
+        blobs[blob_hash] = data
+        return blob_hash
+
+    def _externalize_text(self, key, text, blobs, stored_history):
+        """文字列のコンテキスト項目を保存（直前の同じ項目の続きであれば差分のみ保存）"""
+        ref = {'length': len(text), 'sha256': _text_digest(text)}
+        for index in range(len(stored_history) - 1, -1, -1):
+            base = (stored_history[index].get('context_refs') or {}).get(key)
+            if base is None:
+                continue
+            if (isinstance(base, dict) and base['length'] <= len(text)
+                    and _text_digest(text[:base['length']]) == base['sha256']):
+                ref['base'] = index
+                text = text[base['length']:]
+            break
+        ref['append'] = self._store_blob(text, blobs)
+        return ref
+
+    @staticmethod
+    def _ref_hashes(ref):
+        """参照に含まれるブロブのハッシュ"""
+        if isinstance(ref, list):
+            return ref
+        if isinstance(ref, dict):
+            return [ref['append']]
+        return [ref]
+
+    def _resolve_ref(self, history, ref, key):
+        """参照からコンテキスト項目の値を復元（文字列の差分は base をたどって連結する）"""
+        if isinstance(ref, list):
+            return [value for value in map(self.blob_store.get, ref) if value is not None]
+        if not isinstance(ref, dict):
+            return self.blob_store.get(ref)
+        parts = []
+        while True:
+            part = self.blob_store.get(ref['append'])
+            if part is None:
+                return None
+            parts.append(part)
+            if 'base' not in ref:
                 break
+            base = history[ref['base']]
+            if 'context' in base:
+                parts.append((base['context'] or {}).get(key) or '')
+                break
+            ref = base['context_refs'][key]
+        return ''.join(reversed(parts))
+
+    def resolve_context_field(self, history, index, key):
+        """履歴中のメッセージのコンテキスト項目を取得（参照の場合はブロブから読み込む）"""
+        message = history[index]
+        if 'context' in message:
+            return (message['context'] or {}).get(key)
+        ref = (message.get('context_refs') or {}).get(key)
+        return self._resolve_ref(history, ref, key) if ref is not None else None
+
+    def resolve_history(self, history):
+        """参照になっているコンテキストをすべて展開した履歴を返す"""
+        resolved = []
+        for message in history:
+            context_refs = message.get('context_refs')
+            if context_refs is not None and 'context' not in message:
+                message = {k: v for k, v in message.items() if k != 'context_refs'}
+                context = {}
+                for key, ref in context_refs.items():
+                    if isinstance(ref, dict) and 'base' in ref:
+                        # 差分は展開済みの元メッセージの内容に連結する（履歴全体で線形時間）
+                        base_text = (resolved[ref['base']].get('context') or {}).get(key)
+                        part = self.blob_store.get(ref['append'])
+                        context[key] = None if base_text is None or part is None else base_text + part
+                    else:
+                        context[key] = self._resolve_ref(resolved, ref, key)
+                message['context'] = context
+            resolved.append(message)
+        return resolved
+
+    def save_thread_history(self, thread_id, history):
+        """スレッドの履歴を保存（コンテキストはブロブストアに保存し、参照のみ記録）
+
+        保存した形式（コンテキストを参照に置き換えた履歴）を返す。セッションにはこちらを保持し、
+        次回の保存でコンテキストを再エンコードしないようにする。
+        スレッドが一覧に存在しない（削除済みの）場合は保存せず None を返す。
+        """
+        blobs = {}
+        stored = []
+        for message in history:
+            stored.append(self._externalize_context(message, blobs, stored))
+        # 既存の参照も保持対象に含める
+        for message in stored:
+            for ref in message.get('context_refs', {}).values():
+                for blob_hash in self._ref_hashes(ref):
+                    blobs.setdefault(blob_hash, None)
+
+        # 削除と競合しないよう、存在確認から最終更新日時の更新までをロック内で行う
+        with self._lock_threads():
+            threads = self.list_threads()
+            thread = next((t for t in threads if t['id'] == thread_id), None)
+            if thread is None:
+                return None
+            self.blob_store.set_thread_refs(thread_id, blobs)
+            self._write_json(self._get_thread_file_path(thread_id), stored)
+            thread['updated_at'] = datetime.now().isoformat()
+            self._write_json(self.threads_file, threads)
+        self._invalidate_cache(thread_id)
+        return stored
 
     def update_thread_session_state(self, thread_id, session_state):
         """スレッドのセッション状態を更新"""
-        threads = self.list_threads()
-        for thread in threads:
-            if thread['id'] == thread_id:
-                thread['session_state'] = session_state
-                self.save_thread_info(thread)
-                break
+        def update(thread):
+            thread['session_state'] = session_state
+        return self._update_thread(thread_id, update)
+
+    def record_thread_usage(self, thread_id, usage):
+        """スレッドの通信量・トークン数の累計を更新"""
+        if not usage:
+            return False
+        def update(thread):
+            totals = thread.get('usage') or {}
+            totals['requests'] = totals.get('requests', 0) + 1
+            for key, value in usage.items():
+                totals[key] = totals.get(key, 0) + value
+            thread['usage'] = totals
+        return self._update_thread(thread_id, update)
 
     def get_thread_session_state(self, thread_id):
         """スレッドのセッション状態を取得"""
@@ -96,17 +266,21 @@ class ChatManager:
 
     def delete_thread(self, thread_id):
         """スレッドを削除"""
-        # スレッド履歴ファイルを削除
-        try:
-            os.remove(self._get_thread_file_path(thread_id))
-        except FileNotFoundError:
-            pass
+        with self._lock_threads():
+            # スレッド履歴ファイルを削除
+            try:
+                os.remove(self._get_thread_file_path(thread_id))
+            except FileNotFoundError:
+                pass
 
-        # スレッド一覧から削除
-        threads = self.list_threads()
-        threads = [t for t in threads if t['id'] != thread_id]
-        with open(self.threads_file, 'w', encoding='utf-8') as f:
-            json.dump(threads, f, ensure_ascii=False, indent=2)
+            # スレッド一覧から削除
+            threads = self.list_threads()
+            threads = [t for t in threads if t['id'] != thread_id]
+            self._write_json(self.threads_file, threads)
+
+            # スレッドの参照を解放し、他から参照されていないコンテキストを削除
+            self.blob_store.release_thread(thread_id)
+        self._invalidate_cache(thread_id)
 
     def export_history(self, history, format='json'):
         """チャット履歴をエクスポート"""
@@ -114,14 +288,14 @@ class ChatManager:
             export_data = {
                 'timestamp': datetime.now().isoformat(),
                 'format_version': '1.0',
-                'history': history
+                'history': self.resolve_history(history)
             }
 
             if format == 'json':
-                return json.dumps(export_data, ensure_ascii=False, indent=2)
+                # エクスポート時のみ整形して出力
+                return serializer.dumps_str(export_data, pretty=True)
             elif format == 'base64':
-                json_str = json.dumps(export_data, ensure_ascii=False)
-                return base64.b64encode(json_str.encode('utf-8')).decode('utf-8')
+                return base64.b64encode(serializer.dumps(export_data)).decode('utf-8')
             else:
                 raise ValueError(f"Unsupported format: {format}")
         except Exception as e:
@@ -133,12 +307,11 @@ class ChatManager:
         try:
             if format == 'json':
                 if isinstance(import_data, str):
-                    data = json.loads(import_data)
+                    data = serializer.loads(import_data)
                 else:
                     data = import_data
             elif format == 'base64':
-                decoded_data = base64.b64decode(import_data.encode('utf-8')).decode('utf-8')
-                data = json.loads(decoded_data)
+                data = serializer.loads(base64.b64decode(import_data.encode('utf-8')))
             else:
                 raise ValueError(f"Unsupported format: {format}")
 
@@ -1,9 +1,22 @@
-import json
-from pathlib import Path
+import logging
+import os
+import threading
+import weakref
+import serializer
+from utils import atomic_write, validate_proxy_url
+from sanitizer import OVERSIZE_POLICIES, validate_allowed_tags
+
+logger = logging.getLogger(__name__)
 
 class ConfigManager:
     CONFIG_FILE = "config.json"
 
+    # 読み込み済み設定のキャッシュ（ファイルの更新時刻で変更を検知）
+    _cache = None
+    _cache_mtime = None
+    _subscribers = []
+    _lock = threading.RLock()
+
     @staticmethod
     def get_default_config():
         return {
@@ -15,28 +28,114 @@ class ConfigManager:
             'semantic_ranker': True,
             'semantic_captions': True,
             'followup_questions': True,
-            'prompt_template': ''  # プロンプトテンプレートのデフォルト値
+            'prompt_template': '',  # プロンプトテンプレートのデフォルト値
+            'max_input_size': 5_000_000,  # 入力の最大文字数（0で無制限）
+            'oversize_policy': 'truncate',  # 上限超過時の扱い（truncate / reject）
+            'allowed_tags': [],  # 入力に残すHTMLタグ（空の場合はすべて除去）
+            'max_request_tokens': 32_000  # 1リクエストあたりのトークン上限（0で無制限）
         }
 
-    @staticmethod
-    def load_config():
-        try:
-            with open(ConfigManager.CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            default_config = ConfigManager.get_default_config()
-            ConfigManager.save_config(default_config)
-            return default_config
+    @classmethod
+    def load_config(cls):
+        """設定を取得（ファイルが更新されていなければキャッシュを返す）"""
+        with cls._lock:
+            try:
+                mtime = os.stat(cls.CONFIG_FILE).st_mtime_ns
+            except FileNotFoundError:
+                default_config = cls.get_default_config()
+                cls.save_config(default_config)
+                return dict(default_config)
 
-    @staticmethod
-    def save_config(config):
-        with open(ConfigManager.CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
+            if cls._cache is not None and mtime == cls._cache_mtime:
+                return dict(cls._cache)
+
+            try:
+                with open(cls.CONFIG_FILE, 'rb') as f:
+                    config = {**cls.get_default_config(), **serializer.loads(f.read())}
+                is_valid, message = cls.validate_config(config)
+                if not is_valid:
+                    raise ValueError(message)
+            except (ValueError, serializer.JSONDecodeError) as e:
+                # 不正な設定は反映せず、直前の設定を使い続ける
+                logger.warning(f"Ignoring invalid config file: {str(e)}")
+                cls._cache_mtime = mtime
+                if cls._cache is None:
+                    cls._cache = cls.get_default_config()
+                return dict(cls._cache)
+
+            cls._set_cache(config, mtime)
+            return dict(config)
+
+    @classmethod
+    def save_config(cls, config):
+        """設定を検証し、一時ファイル経由でアトミックに保存"""
+        is_valid, message = cls.validate_config(config)
+        if not is_valid:
+            raise ValueError(message)
+
+        with cls._lock:
+            atomic_write(cls.CONFIG_FILE, serializer.dumps(config, pretty=True), fsync=True)
+            cls._set_cache(dict(config), os.stat(cls.CONFIG_FILE).st_mtime_ns)
+
+    @classmethod
+    def _set_cache(cls, config, mtime):
+        """キャッシュを更新し、内容が変わっていれば購読者に通知"""
+        changed = config != cls._cache
+        cls._cache = config
+        cls._cache_mtime = mtime
+        if changed:
+            cls._notify(config)
+
+    @classmethod
+    def subscribe(cls, callback):
+        """設定変更時に呼び出されるコールバックを登録（メソッドは弱参照で保持）"""
+        with cls._lock:
+            if hasattr(callback, '__self__'):
+                cls._subscribers.append(weakref.WeakMethod(callback))
+            else:
+                cls._subscribers.append(lambda: callback)
+
+    @classmethod
+    def unsubscribe(cls, callback):
+        """コールバックの登録を解除"""
+        with cls._lock:
+            cls._subscribers = [ref for ref in cls._subscribers if ref() not in (None, callback)]
+
+    @classmethod
+    def _notify(cls, config):
+        """購読者に新しい設定を通知"""
+        alive = []
+        for ref in cls._subscribers:
+            callback = ref()
+            if callback is None:
+                continue
+            alive.append(ref)
+            try:
+                callback(dict(config))
+            except Exception as e:
+                logger.error(f"Config subscriber failed: {str(e)}")
+        cls._subscribers = alive
 
     @staticmethod
     def validate_config(config):
-        required_fields = ['proxy_url', 'api_endpoint']
-        for field in required_fields:
-            if not config.get(field):
-                return False, f"Missing required field: {field}"
-        return True, "Configuration is valid"
\ No newline at end of file
+        # プロキシURLは空（プロキシ無し）も許可する
+        if not config.get('api_endpoint'):
+            return False, "Missing required field: api_endpoint"
+        if not validate_proxy_url(config.get('proxy_url', '')):
+            return False, f"Invalid proxy URL: {config.get('proxy_url')}"
+        if not isinstance(config.get('top_k'), int) or config['top_k'] < 1:
+            return False, "top_k must be a positive integer"
+        if not isinstance(config.get('temperature'), (int, float)) or not 0.0 <= config['temperature'] <= 1.0:
+            return False, "temperature must be between 0.0 and 1.0"
+        max_input_size = config.get('max_input_size', 0)
+        if not isinstance(max_input_size, int) or max_input_size < 0:
+            return False, "max_input_size must be a non-negative integer"
+        max_request_tokens = config.get('max_request_tokens', 0)
+        if not isinstance(max_request_tokens, int) or max_request_tokens < 0:
+            return False, "max_request_tokens must be a non-negative integer"
+        if config.get('oversize_policy', 'truncate') not in OVERSIZE_POLICIES:
+            return False, f"oversize_policy must be one of: {', '.join(OVERSIZE_POLICIES)}"
+        is_valid, message = validate_allowed_tags(config.get('allowed_tags', []))
+        if not is_valid:
+            return False, message
+        return True, "Configuration is valid"
@@ -1,17 +1,18 @@
 import logging
-import json
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from datetime import datetime
 import uuid
 from typing import Dict, List, Optional
+import serializer
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse if serializer.HAS_ORJSON else JSONResponse)
 
 # CORS設定を更新
 app.add_middleware(
@@ -42,7 +43,7 @@ async def chat(request: Request):
         logger.info(f"Request path: {request.url.path}")
         logger.info(f"Request method: {request.method}")
 
-        data = await request.json()
+        data = serializer.loads(await request.body())
         logger.info(f"Received request data: {data}")
 
         # 受信したメッセージを取得
@@ -1,21 +1,35 @@
 import logging
-import json
+import os
+import argparse
+import time
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 import httpx
 import uvicorn
 from datetime import datetime
 import ssl
 from urllib.parse import unquote
+from shared_store import SharedStateStore
+import serializer
 
 # ロギングの設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Test Proxy Server")
+app = FastAPI(
+    title="Test Proxy Server",
+    default_response_class=ORJSONResponse if serializer.HAS_ORJSON else JSONResponse
+)
 
-# プロキシリクエストの履歴
-request_history = []
+# 生のバイト列を転送する際に引き継がないヘッダ（httpx側でデコード済み、または接続固有）
+EXCLUDED_RESPONSE_HEADERS = {"content-length", "content-encoding", "transfer-encoding", "connection"}
+
+# プロキシリクエストの履歴・メトリクス（全ワーカーで共有）
+state_store = SharedStateStore(
+    db_path=os.environ.get("PROXY_STATE_DB", "proxy_state.db"),
+    max_history=int(os.environ.get("PROXY_MAX_HISTORY", "100"))
+)
 
 @app.get("/")
 async def read_root():
@@ -24,6 +38,7 @@ async def read_root():
 @app.post("/chat")
 async def proxy_chat(request: Request):
     """チャットリクエストを処理するプロキシハンドラ"""
+    started = time.perf_counter()
     try:
         # リクエストの詳細をログに記録
         request_time = datetime.now().isoformat()
@@ -66,48 +81,82 @@ async def proxy_chat(request: Request):
                 "body": response.text
             }
 
-            # 履歴に記録
-            request_history.append({
-                "request": request_info,
-                "response": response_info
-            })
-
-            # 最大100件まで履歴を保持
-            if len(request_history) > 100:
-                request_history.pop(0)
-
-            # レスポンスの処理
-            try:
-                content = response.json()
-            except json.JSONDecodeError:
-                content = {"text": response.text}
+            # 履歴とメトリクスを1回の書き込みで記録（最大件数を超えた分はストア側で削除）
+            await run_in_threadpool(
+                state_store.record_request,
+                {"request": request_info, "response": response_info},
+                _request_metrics(started, error=False)
+            )
 
-            logger.info(f"Response received: {content}")
-            return JSONResponse(
+            # レスポンスの処理（JSONは再エンコードせずバイト列のまま転送）
+            response_headers = {
+                key: value for key, value in response.headers.items()
+                if key.lower() not in EXCLUDED_RESPONSE_HEADERS
+            }
+            if "json" in response.headers.get("content-type", ""):
+                content = response.content
+            else:
+                content = serializer.dumps({"text": response.text})
+                response_headers["content-type"] = "application/json"
+
+            logger.info(f"Response received: {len(content)} bytes")
+            return Response(
                 content=content,
                 status_code=response.status_code,
-                headers=dict(response.headers)
+                headers=response_headers
             )
 
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP status error: {str(e)}")
+        await run_in_threadpool(state_store.record_request, None, _request_metrics(started, error=True))
         raise HTTPException(status_code=e.response.status_code, detail=str(e))
     except Exception as e:
         logger.error(f"Proxy error: {str(e)}")
+        await run_in_threadpool(state_store.record_request, None, _request_metrics(started, error=True))
         raise HTTPException(status_code=500, detail=str(e))
 
+def _request_metrics(started, error):
+    """リクエスト数・エラー数・処理時間のメトリクス"""
+    metrics = {
+        "requests_total": 1,
+        "latency_seconds_total": time.perf_counter() - started
+    }
+    if error:
+        metrics["errors_total"] = 1
+    return metrics
+
 @app.get("/history")
 async def get_history():
     """プロキシサーバを経由したリクエストの履歴を取得"""
-    return request_history
+    return await run_in_threadpool(state_store.get_history)
 
 @app.post("/clear-history")
 async def clear_history():
     """リクエスト履歴をクリア"""
-    request_history.clear()
+    await run_in_threadpool(state_store.clear_history)
     return {"status": "History cleared"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """全ワーカーで集計したメトリクスを取得"""
+    return await run_in_threadpool(state_store.get_metrics)
+
 
 if __name__ == "__main__":
-    logger.info("Starting proxy server on port 3000...")
-    uvicorn.run(app, host="0.0.0.0", port=3000)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Test Proxy Server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("PROXY_WORKERS", "1")),
+        help="ワーカープロセス数（2以上で本番用マルチワーカーモード）"
+    )
+    args = parser.parse_args()
+
+    logger.info(f"Starting proxy server on port {args.port} with {args.workers} worker(s)...")
+    if args.workers > 1:
+        # マルチワーカーモードではアプリをインポート文字列で渡す必要がある
+        uvicorn.run("proxy_server:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
@@ -0,0 +1,327 @@
+"""保存済みの会話を再送して回帰・スループットを確認するリプレイツール
+
+入力には chat_threads/ のスレッド履歴ファイル、またはプロキシの /history ダンプを指定できる。
+各会話は順番どおりに再送し（前の応答の session_state を引き継ぐ）、
+会話同士は指定した並列数で同時に実行する。
+
+使い方:
+    python replay.py chat_threads --target http://localhost:8000/chat --pacing max --concurrency 8
+    python replay.py history.json --pacing accelerated --speed 10 --report replay_report.json
+"""
+import argparse
+import difflib
+import os
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import requests
+
+import serializer
+from api_client import APIClient
+from config_manager import ConfigManager
+
+
+@dataclass
+class Turn:
+    """再送する1リクエスト"""
+    offset: float  # 最初のリクエストからの経過秒数（元のペース）
+    payload: Dict[str, Any]
+    recorded_answer: Optional[str]
+
+
+@dataclass
+class Conversation:
+    """順番に再送する一連のリクエスト"""
+    conversation_id: str
+    turns: List[Turn] = field(default_factory=list)
+
+
+def _parse_time(iso_string):
+    return datetime.fromisoformat(iso_string).timestamp()
+
+
+def load_thread_file(path, client, thread_info=None):
+    """スレッド履歴ファイルから会話を構築
+
+    メッセージ単位の時刻は保存されていないため、スレッドの作成〜更新日時の間に
+    均等に配置したものを元のペースとみなす。
+    """
+    with open(path, 'rb') as f:
+        history = serializer.loads(f.read())
+    if isinstance(history, dict):
+        # export_history で書き出したファイル
+        history = history.get('history', [])
+    thread_id = os.path.splitext(os.path.basename(path))[0]
+    answer_indexes = [
+        i for i, message in enumerate(history)
+        if message.get('role') == 'assistant' and i > 0 and history[i - 1].get('role') == 'user'
+    ]
+
+    if thread_info:
+        start = _parse_time(thread_info['created_at'])
+        end = _parse_time(thread_info['updated_at'])
+    else:
+        # スレッド一覧に無い場合はファイルの更新時刻にまとめて配置
+        start = end = os.path.getmtime(path)
+
+    conversation = Conversation(thread_id)
+    for n, i in enumerate(answer_indexes):
+        offset = start + (end - start) * (n + 1) / len(answer_indexes)
+        conversation.turns.append(Turn(
+            offset=offset,
+            payload=client._prepare_request_data(history[:i], thread_id),
+            recorded_answer=history[i].get('content')
+        ))
+    return conversation
+
+
+def load_history_dump(path):
+    """プロキシの /history ダンプから会話を構築（thread_id ごとにまとめる）"""
+    with open(path, 'rb') as f:
+        entries = serializer.loads(f.read())
+
+    conversations = {}
+    for n, entry in enumerate(entries):
+        request_info = entry.get('request') or {}
+        if not request_info.get('body'):
+            continue
+        payload = serializer.loads(request_info['body'])
+        thread_id = (payload.get('context') or {}).get('thread_id') or f"entry-{n}"
+
+        recorded_answer = None
+        try:
+            response_body = serializer.loads((entry.get('response') or {}).get('body') or '')
+            recorded_answer = (response_body.get('message') or {}).get('content')
+        except (serializer.JSONDecodeError, AttributeError):
+            pass
+
+        conversation = conversations.setdefault(thread_id, Conversation(thread_id))
+        conversation.turns.append(Turn(
+            offset=_parse_time(request_info['timestamp']),
+            payload=payload,
+            recorded_answer=recorded_answer
+        ))
+    return list(conversations.values())
+
+
+def load_sources(sources, client):
+    """入力パス（ディレクトリ・スレッドファイル・履歴ダンプ）を読み込む"""
+    thread_index = {t['id']: t for t in _load_thread_index()}
+    conversations = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths = sorted(
+                os.path.join(source, name) for name in os.listdir(source) if name.endswith('.json')
+            )
+        else:
+            paths = [source]
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = serializer.loads(f.read())
+            if isinstance(data, list) and data and isinstance(data[0], dict) and 'request' in data[0]:
+                conversations.extend(load_history_dump(path))
+            else:
+                thread_id = os.path.splitext(os.path.basename(path))[0]
+                conversations.append(load_thread_file(path, client, thread_index.get(thread_id)))
+
+    # オフセットを最初のリクエストからの相対秒数に揃える
+    conversations = [c for c in conversations if c.turns]
+    if conversations:
+        origin = min(turn.offset for c in conversations for turn in c.turns)
+        for conversation in conversations:
+            for turn in conversation.turns:
+                turn.offset -= origin
+    return conversations
+
+
+def _load_thread_index():
+    """スレッド一覧（作成・更新日時）を取得"""
+    try:
+        with open("chat_threads.json", 'rb') as f:
+            return serializer.loads(f.read())
+    except FileNotFoundError:
+        return []
+
+
+class Replayer:
+    """会話を並列に再送し、結果を収集する"""
+
+    def __init__(self, target, speed=None, concurrency=4, timeout=30, proxies=None):
+        self.target = target
+        self.speed = speed  # None の場合は待機せず最大レートで送信
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.proxies = proxies or {}
+        self.results = []
+        self._results_lock = threading.Lock()
+        self._local = threading.local()
+        self._started = None
+
+    def _get_session(self):
+        """ワーカースレッドごとのセッション（接続プールを再利用）"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.proxies = self.proxies
+            self._local.session = session
+        return session
+
+    def run(self, conversations):
+        """全会話を再送し、所要時間（秒）を返す"""
+        self._started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self._replay_conversation, conversations))
+        return time.perf_counter() - self._started
+
+    def _replay_conversation(self, conversation):
+        session_state = None
+        for index, turn in enumerate(conversation.turns):
+            lag = self._wait_for(turn.offset)
+            payload = dict(turn.payload, session_state=session_state)
+            result = {
+                "conversation_id": conversation.conversation_id,
+                "turn": index,
+                "scheduled_offset": turn.offset,
+                "lag": lag,
+            }
+            started = time.perf_counter()
+            try:
+                response = self._get_session().post(
+                    self.target,
+                    data=serializer.dumps(payload),
+                    headers={'Content-Type': 'application/json'},
+                    timeout=self.timeout
+                )
+                result["latency"] = time.perf_counter() - started
+                result["status_code"] = response.status_code
+                response.raise_for_status()
+                response_data = serializer.loads(response.content)
+                if not isinstance(response_data, dict):
+                    # 想定外の形式の応答は会話を中断せず、このターンのエラーとして記録
+                    result["error"] = f"Unexpected response format: {type(response_data).__name__}"
+                else:
+                    session_state = response_data.get("session_state")
+                    message = response_data.get("message")
+                    answer = message.get("content") if isinstance(message, dict) else None
+                    result.update(_compare_answers(turn.recorded_answer, answer))
+                    if response_data.get("error"):
+                        result["error"] = response_data["error"]
+            except (requests.exceptions.RequestException, serializer.JSONDecodeError) as e:
+                result.setdefault("latency", time.perf_counter() - started)
+                result["error"] = str(e)
+            with self._results_lock:
+                self.results.append(result)
+
+    def _wait_for(self, offset):
+        """予定時刻まで待機し、予定からの遅れ（秒）を返す"""
+        if self.speed is None:
+            return 0.0
+        due = offset / self.speed
+        elapsed = time.perf_counter() - self._started
+        if due > elapsed:
+            time.sleep(due - elapsed)
+            return 0.0
+        return elapsed - due
+
+
+def _compare_answers(recorded, replayed):
+    """記録された応答と再送した応答を比較"""
+    if recorded is None:
+        return {"matched": None}
+    replayed = replayed or ''
+    result = {
+        "matched": recorded == replayed,
+        "similarity": round(difflib.SequenceMatcher(None, recorded, replayed).ratio(), 4),
+    }
+    if not result["matched"]:
+        result["diff"] = "\n".join(difflib.unified_diff(
+            recorded.splitlines(), replayed.splitlines(),
+            fromfile="recorded", tofile="replayed", lineterm=""
+        ))[:2000]
+    return result
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(results, duration):
+    """リプレイ結果の集計"""
+    latencies = [r["latency"] for r in results if "latency" in r]
+    compared = [r for r in results if r.get("matched") is not None]
+    summary = {
+        "turns": len(results),
+        "errors": sum(1 for r in results if r.get("error")),
+        "duration_seconds": round(duration, 3),
+        "throughput_rps": round(len(results) / duration, 2) if duration else None,
+        "max_lag_seconds": round(max((r["lag"] for r in results), default=0.0), 3),
+        "compared": len(compared),
+        "exact_matches": sum(1 for r in compared if r["matched"]),
+        "mean_similarity": round(statistics.mean(r["similarity"] for r in compared), 4) if compared else None,
+    }
+    if latencies:
+        summary["latency_ms"] = {
+            "mean": round(statistics.mean(latencies) * 1000, 2),
+            "p50": round(_percentile(latencies, 50) * 1000, 2),
+            "p90": round(_percentile(latencies, 90) * 1000, 2),
+            "p99": round(_percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies) * 1000, 2),
+        }
+    return summary
+
+
+def main():
+    config = ConfigManager.load_config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sources", nargs="+", help="chat_threads ディレクトリ、スレッドファイル、または /history ダンプ")
+    parser.add_argument("--target", default=None, help="再送先のチャットエンドポイント（省略時は設定の api_endpoint）")
+    parser.add_argument("--proxy", default=None, help="経由するプロキシURL（例: http://localhost:3000）")
+    parser.add_argument("--pacing", choices=["original", "accelerated", "max"], default="max")
+    parser.add_argument("--speed", type=float, default=10.0, help="accelerated 時の倍速")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に再送する会話数")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--report", default="replay_report.json", help="結果レポートの出力先")
+    args = parser.parse_args()
+
+    client = APIClient(config)
+    if args.target is None:
+        # APIClient と同様に /chat を補ったエンドポイントを使用
+        try:
+            args.target = client._get_chat_endpoint()
+        except ValueError as e:
+            parser.error(str(e))
+    conversations = load_sources(args.sources, client)
+    speed = {"original": 1.0, "accelerated": args.speed, "max": None}[args.pacing]
+    proxies = {'http': args.proxy, 'https': args.proxy} if args.proxy else None
+
+    replayer = Replayer(args.target, speed=speed, concurrency=args.concurrency,
+                        timeout=args.timeout, proxies=proxies)
+    total_turns = sum(len(c.turns) for c in conversations)
+    print(f"Replaying {total_turns} turns from {len(conversations)} conversations to {args.target} ({args.pacing})")
+    duration = replayer.run(conversations)
+
+    summary = summarize(replayer.results, duration)
+    report = {
+        "target": args.target,
+        "pacing": args.pacing,
+        "speed": speed,
+        "concurrency": args.concurrency,
+        "summary": summary,
+        "results": sorted(replayer.results, key=lambda r: (r["conversation_id"], r["turn"])),
+    }
+    with open(args.report, 'wb') as f:
+        f.write(serializer.dumps(report, pretty=True))
+
+    print(serializer.dumps_str(summary, pretty=True))
+    print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""ユーザー入力のサニタイズ処理
+
+正規表現のバックトラックに依存しない走査で、入力長に対して線形時間で処理する。
+処理内容は従来の utils.sanitize_input と同じく
+1. <script ...>...</script> ブロックの除去（大文字小文字を区別しない）
+2. 同一行内で閉じている <...> タグの除去（許可リストモードでは指定タグのみ残す）
+の2段階。
+"""
+import re
+
+# 事前コンパイル済みパターン（いずれも固定長の照合のみでバックトラックしない）
+SCRIPT_OPEN = re.compile(r'<script', re.IGNORECASE)
+SCRIPT_CLOSE = re.compile(r'</script>', re.IGNORECASE)
+TAG_NAME = re.compile(r'<(/?)\s*([a-zA-Z][a-zA-Z0-9]*)')
+ALLOWED_TAG_NAME = re.compile(r'[a-zA-Z][a-zA-Z0-9]*')
+
+OVERSIZE_POLICIES = ('truncate', 'reject')
+# 許可リストに指定できないタグ（閉じタグの無い <script> が残らないようにする）
+FORBIDDEN_TAGS = frozenset({'script'})
+
+
+def validate_allowed_tags(allowed_tags):
+    """許可タグの指定を検証し、(成否, メッセージ) を返す"""
+    if not isinstance(allowed_tags, (list, tuple)):
+        return False, "allowed_tags must be a list of tag names"
+    for tag in allowed_tags:
+        if not isinstance(tag, str) or not ALLOWED_TAG_NAME.fullmatch(tag):
+            return False, f"Invalid tag name in allowed_tags: {tag!r}"
+        if tag.lower() in FORBIDDEN_TAGS:
+            return False, f"Tag cannot be allowed: {tag}"
+    return True, None
+
+
+class InputSanitizer:
+    """入力サニタイズの設定（サイズ上限・許可タグ）を保持するエンジン"""
+
+    def __init__(self, max_input_size=5_000_000, oversize_policy='truncate', allowed_tags=None):
+        if oversize_policy not in OVERSIZE_POLICIES:
+            raise ValueError(f"Unsupported oversize policy: {oversize_policy}")
+        is_valid, message = validate_allowed_tags(list(allowed_tags or ()))
+        if not is_valid:
+            raise ValueError(message)
+        self.max_input_size = max_input_size
+        self.oversize_policy = oversize_policy
+        self.allowed_tags = frozenset(tag.lower() for tag in allowed_tags or ())
+
+    def sanitize(self, text):
+        """入力をサニタイズ（上限超過時は policy に従い切り詰めまたは ValueError）"""
+        if not text:
+            return text
+        if self.max_input_size and len(text) > self.max_input_size:
+            if self.oversize_policy == 'reject':
+                raise ValueError(
+                    f"Input is too large: {len(text)} characters (limit {self.max_input_size})"
+                )
+            text = text[:self.max_input_size]
+        text = self._remove_script_blocks(text)
+        text = self._remove_tags(text)
+        return text.strip()
+
+    @staticmethod
+    def _remove_script_blocks(text):
+        """<script ...>...</script> を除去"""
+        parts = []
+        pos = 0
+        while True:
+            start = SCRIPT_OPEN.search(text, pos)
+            if start is None:
+                break
+            gt = text.find('>', start.end())
+            if gt == -1:
+                # 以降の <script にも閉じ '>' は存在しない
+                break
+            end = SCRIPT_CLOSE.search(text, gt + 1)
+            if end is None:
+                # 以降の <script でも </script> は見つからない
+                break
+            parts.append(text[pos:start.start()])
+            pos = end.end()
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+    def _remove_tags(self, text):
+        """同一行内で閉じているタグを除去（許可タグは属性を除いて残す）"""
+        parts = []
+        pos = 0
+        length = len(text)
+        # 次の '>' と改行の位置は単調増加するのでキャッシュして再走査を避ける
+        next_gt = next_nl = -1
+        while True:
+            lt = text.find('<', pos)
+            if lt == -1:
+                break
+            if next_gt <= lt:
+                next_gt = text.find('>', lt + 1)
+                if next_gt == -1:
+                    next_gt = length
+            if next_nl <= lt:
+                next_nl = text.find('\n', lt + 1)
+                if next_nl == -1:
+                    next_nl = length
+
+            if next_gt < length and next_gt < next_nl:
+                parts.append(text[pos:lt])
+                if self.allowed_tags:
+                    parts.append(self._allowed_tag(text, lt, next_gt))
+                pos = next_gt + 1
+            elif next_gt == length:
+                # 以降に '>' が無いので残りはすべてそのまま残す
+                break
+            else:
+                # 改行までに '>' が無いので、その行の '<' はすべてそのまま残す
+                parts.append(text[pos:next_nl + 1])
+                pos = next_nl + 1
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+    def _allowed_tag(self, text, start, end):
+        """許可タグであれば属性を除いた形で返す"""
+        match = TAG_NAME.match(text, start, end)
+        if match and match.group(2).lower() in self.allowed_tags:
+            return f"<{match.group(1)}{match.group(2).lower()}>"
+        return ''
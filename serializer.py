@@ -0,0 +1,40 @@
+"""JSONシリアライザ（orjsonが利用可能な場合は高速パスを使用）
+
+orjson が未インストールの環境では標準ライブラリの json にフォールバックする。
+どちらの実装でも出力は UTF-8（ensure_ascii=False 相当）に統一する。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson が無い環境用
+    orjson = None
+
+HAS_ORJSON = orjson is not None
+
+# 両実装の JSONDecodeError を捕捉できる例外（orjson のものは json のサブクラス）
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps(obj, pretty=False, sort_keys=False):
+    """オブジェクトを JSON の bytes に変換（pretty=True でインデント付き、sort_keys=True でキー順を正規化）"""
+    if HAS_ORJSON:
+        option = orjson.OPT_INDENT_2 if pretty else 0
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=sort_keys).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), sort_keys=sort_keys).encode('utf-8')
+
+
+def dumps_str(obj, pretty=False):
+    """オブジェクトを JSON 文字列に変換"""
+    return dumps(obj, pretty=pretty).decode('utf-8')
+
+
+def loads(data):
+    """JSON の bytes / str をデコード"""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import threading
+
+import serializer
+
+
+class SharedStateStore:
+    """複数ワーカープロセス間で共有する状態ストア（SQLiteバックエンド）"""
+
+    def __init__(self, db_path="proxy_state.db", max_history=100):
+        self.db_path = db_path
+        self.max_history = max_history
+        self._local = threading.local()
+        self._ensure_schema()
+
+    def _get_connection(self):
+        """スレッド・プロセスごとの接続を取得"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_schema(self):
+        """テーブルを作成"""
+        conn = self._get_connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "entry TEXT NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS metrics ("
+            "name TEXT PRIMARY KEY, "
+            "value REAL NOT NULL DEFAULT 0)"
+        )
+
+    def record_request(self, entry=None, metrics=None):
+        """履歴の追加（最大件数を超えた古い履歴は削除）とメトリクスの加算を1つのトランザクションで記録
+
+        全ワーカーが単一の書き込みロックを共有するため、1リクエストあたりの書き込みは1回にまとめる。
+        """
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if entry is not None:
+                cursor = conn.execute(
+                    "INSERT INTO history (entry) VALUES (?)",
+                    (serializer.dumps_str(entry),)
+                )
+                conn.execute(
+                    "DELETE FROM history WHERE id <= ?",
+                    (cursor.lastrowid - self.max_history,)
+                )
+            if metrics:
+                conn.executemany(
+                    "INSERT INTO metrics (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    list(metrics.items())
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_history(self):
+        """履歴を古い順に取得"""
+        conn = self._get_connection()
+        rows = conn.execute("SELECT entry FROM history ORDER BY id").fetchall()
+        return [serializer.loads(row[0]) for row in rows]
+
+    def clear_history(self):
+        """履歴をクリア"""
+        self._get_connection().execute("DELETE FROM history")
+
+    def get_metrics(self):
+        """全メトリクスを取得"""
+        rows = self._get_connection().execute("SELECT name, value FROM metrics").fetchall()
+        return {name: value for name, value in rows}
@@ -0,0 +1,122 @@
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+def _estimate_size(obj):
+    """デコード済み JSON オブジェクトのメモリ使用量を概算（共有される文字列も個別に数える）"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_estimate_size(key) + _estimate_size(value) for key, value in obj.items())
+    elif isinstance(obj, list):
+        size += sum(_estimate_size(item) for item in obj)
+    return size
+
+class ThreadCache:
+    """デコード済みのスレッド履歴を保持するサイズ上限付きLRUキャッシュ
+
+    Streamlit の全セッションで共有する想定のため、スレッドセーフに実装する。
+    エントリはファイルの更新時刻で検証し、ChatManager の書き込み時には明示的に無効化される。
+    max_bytes はデコード後のオブジェクトのメモリ使用量（sys.getsizeof の合計による概算）の上限で、
+    ディスク上の JSON のサイズより数倍大きくなる。
+    """
+
+    def __init__(self, chat_manager, max_bytes=64 * 1024 * 1024, max_entries=100):
+        self.chat_manager = chat_manager
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # thread_id -> (mtime, 推定メモリ使用量, history)
+        self._total_bytes = 0
+        self._index = None  # (mtime, threads)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thread-prefetch")
+
+    def _stat(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def list_threads(self):
+        """スレッド一覧を取得（一覧ファイルが更新されていなければキャッシュを返す）"""
+        mtime = self._stat(self.chat_manager.threads_file)
+        if mtime is None:
+            return []
+        with self._lock:
+            if self._index is not None and self._index[0] == mtime:
+                return [dict(thread) for thread in self._index[1]]
+        threads = self.chat_manager.list_threads()
+        with self._lock:
+            self._index = (mtime, threads)
+        return [dict(thread) for thread in threads]
+
+    def get_thread_session_state(self, thread_id):
+        """スレッドのセッション状態を取得"""
+        for thread in self.list_threads():
+            if thread['id'] == thread_id:
+                return thread.get('session_state')
+        return None
+
+    def get_thread_history(self, thread_id):
+        """スレッドの履歴を取得（呼び出し側で追記できるようリストはコピーして返す）"""
+        mtime = self._stat(self.chat_manager._get_thread_file_path(thread_id))
+        if mtime is None:
+            return []
+        with self._lock:
+            entry = self._entries.get(thread_id)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(thread_id)
+                return list(entry[2])
+        history = self.chat_manager.get_thread_history(thread_id)
+        self._store(thread_id, mtime, history)
+        return list(history)
+
+    def _store(self, thread_id, mtime, history):
+        """エントリを追加し、上限を超えた分を古い順に削除"""
+        size = _estimate_size(history)
+        with self._lock:
+            old = self._entries.pop(thread_id, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            self._entries[thread_id] = (mtime, size, history)
+            self._total_bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+
+    def invalidate(self, thread_id=None):
+        """スレッドのエントリとスレッド一覧のキャッシュを無効化"""
+        with self._lock:
+            if thread_id is not None:
+                entry = self._entries.pop(thread_id, None)
+                if entry is not None:
+                    self._total_bytes -= entry[1]
+            self._index = None
+
+    def prefetch(self, thread_ids):
+        """指定スレッドの履歴をバックグラウンドで読み込む"""
+        with self._lock:
+            targets = [
+                thread_id for thread_id in thread_ids
+                if thread_id not in self._entries and thread_id not in self._pending
+            ]
+            self._pending.update(targets)
+        for thread_id in targets:
+            self._executor.submit(self._prefetch_one, thread_id)
+
+    def _prefetch_one(self, thread_id):
+        try:
+            self.get_thread_history(thread_id)
+        except Exception as e:
+            # 書き込み途中などで読めない場合は次回の取得時に読み直す
+            logger.warning(f"Failed to prefetch thread {thread_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(thread_id)
@@ -0,0 +1,71 @@
+"""リクエストのトークン数見積もり
+
+tiktoken がインストールされ、エンコーディングをオフラインで読み込める場合はそれを使用し、
+それ以外は文字種に基づく高速なヒューリスティックで見積もる。
+tiktoken を使う場合はメッセージ単位の結果をキャッシュするため、履歴全体を毎回数え直すコストはかからない。
+キャッシュのキーはテキストのダイジェストとし、巨大なプロンプト文字列自体は保持しない。
+ヒューリスティックはダイジェストの計算と同程度のコストのため、キャッシュしない。
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # 未インストール、またはエンコーディングを取得できない環境
+    _encoding = None
+
+HAS_TOKENIZER = _encoding is not None
+
+# メッセージごとの役割・区切りに相当する固定オーバーヘッド
+MESSAGE_OVERHEAD_TOKENS = 4
+REQUEST_OVERHEAD_TOKENS = 3
+
+CACHE_SIZE = 4096
+_cache = OrderedDict()  # テキストのダイジェスト -> トークン数（tiktoken 使用時のみ）
+_cache_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """テキストのトークン数を見積もる（tiktoken 使用時は結果をダイジェスト単位でキャッシュ）"""
+    if not text:
+        return 0
+    if _encoding is None:
+        return _estimate_heuristic(text)
+    key = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    with _cache_lock:
+        count = _cache.get(key)
+        if count is not None:
+            _cache.move_to_end(key)
+            return count
+    count = len(_encoding.encode(text, disallowed_special=()))
+    with _cache_lock:
+        _cache[key] = count
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return count
+
+
+def _estimate_heuristic(text):
+    # ASCII はおよそ4文字で1トークン、日本語などの非ASCII文字は1文字1トークンとみなす
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def estimate_message_tokens(message):
+    """1メッセージ分のトークン数を見積もる"""
+    return MESSAGE_OVERHEAD_TOKENS + estimate_tokens(message.get('role', '')) + estimate_tokens(message.get('content', ''))
+
+
+def estimate_request_tokens(request_data):
+    """_prepare_request_data で作成したペイロードのプロンプトトークン数を見積もる"""
+    overrides = (request_data.get('context') or {}).get('overrides') or {}
+    return (
+        REQUEST_OVERHEAD_TOKENS
+        + sum(estimate_message_tokens(message) for message in request_data.get('messages', []))
+        + estimate_tokens(overrides.get('prompt_template', ''))
+    )
@@ -1,5 +1,16 @@
-import re
+import os
+import tempfile
+from contextlib import contextmanager
 from urllib.parse import urlparse
+from sanitizer import InputSanitizer
+
+try:
+    import fcntl
+except ImportError:  # Windows など
+    fcntl = None
+
+# 既定設定のサニタイザ（パターンは事前コンパイル済み）
+_default_sanitizer = InputSanitizer()
 
 def validate_proxy_url(url):
     """Validate proxy URL format"""
@@ -15,14 +26,39 @@ def validate_proxy_url(url):
     except:
         return False
 
-def sanitize_input(text):
+def sanitize_input(text, sanitizer=None):
     """Sanitize user input"""
-    if not text:
-        return text
-    # Remove any potential script tags or dangerous HTML
-    text = re.sub(r'<script.*?>.*?</script>', '', text, flags=re.DOTALL)
-    text = re.sub(r'<.*?>', '', text)
-    return text.strip()
+    # Remove any potential script tags or dangerous HTML in a single linear-time scan
+    return (sanitizer or _default_sanitizer).sanitize(text)
+
+def atomic_write(path, data, fsync=False):
+    """一時ファイル経由でアトミックに書き込み（読み込み側が書き込み途中の内容を読まないようにする）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}-", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@contextmanager
+def file_lock(path):
+    """ロックファイルによるプロセス間の排他（fcntl が使えない環境ではロックしない）"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
 
 def format_error_message(error):
     """Format error messages for display"""